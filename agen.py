@@ -1,9 +1,27 @@
+import logging
 import os
+import platform
+import queue
+import random
+import sys
 import threading
-import chess
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
 import berserk
-import random
+import chess
+import chess.polyglot
+import requests
+from chess.polyglot import zobrist_hash
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from stockfish import Stockfish
+
+# Level-gated logging instead of print; the handler is attached in __main__
+log = logging.getLogger("agen")
+log.setLevel(logging.INFO)
+log.addHandler(logging.NullHandler())
 
 # --- 1. SETUP & AUTHENTICATION ---
 load_dotenv()
@@ -18,39 +36,47 @@ if not LICHESS_TOKEN:
 session = berserk.TokenSession(LICHESS_TOKEN)
 client = berserk.Client(session=session)
 
-import platform
-import time
-import requests
-
 # --- 2. THE REASONING BRAIN (Stockfish) ---
-from stockfish import Stockfish
-
 # Telegram Settings
 TELEGRAM_TOKEN = os.getenv("telegram_token")
 TELEGRAM_CHAT_ID = os.getenv("telegram_chat_id")
 
+# One pooled session + background worker so notifications never block a game thread
+_tg_session = requests.Session()
+_tg_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=4))
+_tg_queue = queue.Queue()
+
+def _telegram_worker():
+    """Drains the notification queue and posts each message to Telegram."""
+    url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage"
+    while True:
+        message = _tg_queue.get()
+        payload = {
+            "chat_id": TELEGRAM_CHAT_ID,
+            "text": message,
+            "parse_mode": "Markdown"
+        }
+        try:
+            _tg_session.post(url, json=payload, timeout=5)
+        except Exception as e:
+            log.warning("⚠️ Telegram Failed: %s", e)
+
+if TELEGRAM_TOKEN and TELEGRAM_CHAT_ID:
+    threading.Thread(target=_telegram_worker, daemon=True).start()
+
 def send_telegram(message):
-    """Sends a notification to Telegram."""
+    """Queues a notification to Telegram (non-blocking)."""
     if not TELEGRAM_TOKEN or not TELEGRAM_CHAT_ID:
         return
-    
-    url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage"
-    payload = {
-        "chat_id": TELEGRAM_CHAT_ID,
-        "text": message,
-        "parse_mode": "Markdown"
-    }
-    try:
-        requests.post(url, json=payload, timeout=10)
-    except Exception as e:
-        print(f"⚠️ Telegram Failed: {e}")
+    _tg_queue.put(message)
 
 # --- GLOBAL MEMORY ---
 # Stores: {'last_opponent': 'username', 'last_result': 'loss/win/draw'}
+# Usernames are lowercased on write so lookups don't need to normalize
 BOT_MEMORY = {
     'last_opponent': None,
     'last_result': None,
-    'conquered_bots': set() # Bots we have beaten
+    'conquered_bots': set() # Bots we have beaten (lowercased usernames)
 }
 
 # Determine Stockfish path based on OS
@@ -70,99 +96,323 @@ else:
     else:
         STOCKFISH_PATH = "stockfish"
 
+# Polyglot opening book (optional): set 'book_path' in .env, defaults to book.bin next to this file
+BOOK_PATH = os.getenv("book_path") or os.path.join(os.path.dirname(__file__), "book.bin")
+
+def available_cpus():
+    """Returns the CPUs this process may run on (respects container cpusets on Linux)."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 2))
+
+def pin_all_threads(pid, cpus):
+    """Sets the CPU affinity of every thread of a process (Linux)."""
+    for tid in os.listdir(f"/proc/{pid}/task"):
+        os.sched_setaffinity(int(tid), cpus)
+
+TT_SIZE = 4096 # Max cached positions
+EVAL_DEPTH = 12 # Depth used for draw-offer evaluations
+MAX_MOVE_TIME_MS = 2500 # Think time cap per move
+MIN_MOVE_TIME_MS = 100 # Think time floor when low on clock
+
 class StockfishBrain:
     """
     Uses Stockfish engine for strong chess play.
+    Shared between game threads, so engine access is serialized by a lock.
     """
     def __init__(self):
+        self.lock = threading.Lock() # UCI is stateful, one caller at a time
+        # Transposition cache: zobrist key -> (best_move_uci, move_budget_ms, eval_cp, eval_depth)
+        self._tt = OrderedDict()
+        # Search ownership for stop(), guarded separately so stop() never waits on a search
+        self._search_guard = threading.Lock()
+        self._searching_for = None # Owner of the running search
+        self._search_id = 0 # Incremented per search
+        self._stopped_search = None # Id of the last search that was asked to stop
+        self._go_sent = False # Whether the current search's 'go' reached the engine
         try:
+            # Scale search to the CPUs we may use: leave one core for network IO
+            cpus = available_cpus()
+            cpu = len(cpus)
+            threads = max(1, cpu - 1)
+            hash_mb = 256 if cpu >= 4 else 128
+            
             # Using depth 24 for Maximum Strength
             self.engine = Stockfish(path=STOCKFISH_PATH, depth=24, parameters={
-                "Threads": 2, 
-                "Hash": 128, # Increased Hash for better performance 
+                "Threads": threads, 
+                "Hash": hash_mb, # Bigger Hash on bigger hosts
                 "Contempt": 25, # More aggressive
                 "Minimum Thinking Time": 1000
             })
             self.engine.set_skill_level(20)
-            print("✅ Super Stockfish engine loaded successfully! (Depth: 24, Hash: 128)")
+            self._track_go()
+            self._pin_cpus(cpus)
+            log.info("✅ Super Stockfish engine loaded successfully! (Depth: 24, Threads: %s, Hash: %s)", threads, hash_mb)
         except Exception as e:
-            print(f"❌ Failed to load Stockfish: {e}")
+            log.error("❌ Failed to load Stockfish: %s", e)
             self.engine = None
+        
+        self._book = None
+        if not os.path.exists(BOOK_PATH):
+            log.info("📖 No opening book at %s, using Stockfish from move 1.", BOOK_PATH)
+        else:
+            try:
+                self._book = chess.polyglot.open_reader(BOOK_PATH)
+                log.info("📖 Opening book loaded: %s", BOOK_PATH)
+            except Exception as e:
+                log.warning("⚠️ Failed to load opening book (%s), using Stockfish from move 1.", e)
     
-    def decide_move(self, board: chess.Board):
-        fen = board.fen()
-        print(f"🧠 MAX POWER Stockfish Thinking... (FEN: {fen})")
+    def book_move(self, board):
+        """Returns a weighted random move from the opening book, or None when out of book."""
+        if self._book is None:
+            return None
+        try:
+            entry = self._book.weighted_choice(board)
+        except IndexError:
+            return None
+        log.info("📖 Book Move: %s", entry.move.uci())
+        return entry.move
+
+    def _pin_cpus(self, cpus):
+        """Linux only: keeps every Python thread on the first CPU and every engine thread on the rest."""
+        if len(cpus) < 2 or not hasattr(os, "sched_setaffinity"):
+            return
+        try:
+            # Affinity is per thread on Linux, so set it on each task of both processes.
+            # Threads spawned later inherit the mask of the thread that creates them.
+            pin_all_threads(self.engine._stockfish.pid, set(cpus[1:]))
+            pin_all_threads(os.getpid(), {cpus[0]})
+        except Exception as e:
+            log.warning("⚠️ CPU pinning skipped: %s", e)
+
+    def _track_go(self):
+        """Wraps the engine's command writer so a stop that arrived before 'go' is sent right after it."""
+        put = self.engine._put
+        
+        def put_and_track(command):
+            put(command)
+            if command.startswith("go"):
+                with self._search_guard:
+                    self._go_sent = True
+                    if self._searching_for is not None and self._stopped_search == self._search_id:
+                        put("stop")
+        
+        self.engine._put = put_and_track
+
+    def stop(self, owner):
+        """Interrupts the running search if it was started by owner (it then returns early)."""
+        with self._search_guard:
+            if self.engine is not None and self._searching_for == owner:
+                self._stopped_search = self._search_id
+                # Before 'go' the engine would ignore it; _track_go sends it once 'go' is out
+                if self._go_sent:
+                    # python-stockfish has no public stop; a stray stop on an idle engine is ignored
+                    self.engine._put("stop")
+
+    def _tt_get(self, key):
+        """Returns the cached entry for a position (marking it recently used), or None."""
+        entry = self._tt.get(key)
+        if entry is not None:
+            self._tt.move_to_end(key)
+        return entry
+
+    def _tt_store(self, key, best_move_uci=None, move_budget_ms=0, eval_cp=None, eval_depth=0):
+        """Merges new results into the cache entry for a position, evicting the oldest on overflow."""
+        old = self._tt.get(key)
+        if old is not None:
+            if best_move_uci is None:
+                best_move_uci, move_budget_ms = old[0], old[1]
+            if eval_cp is None or old[3] > eval_depth:
+                eval_cp, eval_depth = old[2], old[3]
+        self._tt[key] = (best_move_uci, move_budget_ms, eval_cp, eval_depth)
+        self._tt.move_to_end(key)
+        if len(self._tt) > TT_SIZE:
+            self._tt.popitem(last=False)
+
+    def decide_move(self, board: chess.Board, budget_ms=MAX_MOVE_TIME_MS, owner=None, should_abort=None):
+        legal = board.legal_moves # Lazy generator, only materialized on fallback
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("🧠 MAX POWER Stockfish Thinking... (FEN: %s)", board.fen())
         
         if self.engine is None:
-            return random.choice(list(board.legal_moves))
+            return random.choice(list(legal))
         
+        key = zobrist_hash(board)
         try:
-            self.engine.set_fen_position(fen)
-            
-            # Think for 2.5 seconds or until depth is reached
-            best_move_uci = self.engine.get_best_move_time(2500)
+            with self.lock:
+                entry = self._tt_get(key)
+                # Only reuse a move searched at least as long as we can afford now
+                if entry is not None and entry[0] and entry[1] >= budget_ms:
+                    log.info("⚡ Cached Move: %s", entry[0])
+                    return chess.Move.from_uci(entry[0])
+                
+                # Keep the hash table: no ucinewgame between positions/games
+                self.engine.set_fen_position(board.fen(), send_ucinewgame_token=False)
+                
+                # Think for the clock-based budget (movetime search, depth is not a limit here)
+                with self._search_guard:
+                    self._search_id += 1
+                    search_id = self._search_id
+                    self._searching_for = owner
+                    self._go_sent = False
+                    # A stop that came before we took ownership shows up here
+                    if should_abort is not None and should_abort():
+                        self._stopped_search = search_id
+                try:
+                    best_move_uci = self.engine.get_best_move_time(budget_ms)
+                finally:
+                    with self._search_guard:
+                        self._searching_for = None
+                        self._go_sent = False
+                # An interrupted search is too shallow to cache
+                if best_move_uci and self._stopped_search != search_id:
+                    self._tt_store(key, best_move_uci=best_move_uci, move_budget_ms=budget_ms)
             
             if best_move_uci:
-                print(f"🤖 Stockfish Determined: {best_move_uci}")
+                log.info("🤖 Stockfish Determined: %s", best_move_uci)
                 return chess.Move.from_uci(best_move_uci)
             
-            print("⚠️ Stockfish returned invalid move, playing random.")
-            return random.choice(list(board.legal_moves))
+            log.warning("⚠️ Stockfish returned invalid move, playing random.")
+            return random.choice(list(legal))
             
         except Exception as e:
-            print(f"❌ Stockfish Error: {e}")
-            return random.choice(list(board.legal_moves))
+            log.error("❌ Stockfish Error: %s", e)
+            return random.choice(list(legal))
     def get_evaluation(self, board):
         """Returns centipawn evaluation for the side to move. Positive = advantage."""
         if self.engine is None:
             return 0
         try:
-            self.engine.set_fen_position(board.fen())
-            eval = self.engine.get_evaluation()
-            # eval is like {'type': 'cp', 'value': 35} or {'type': 'mate', 'value': -2}
-            
-            if eval['type'] == 'mate':
-                # Mate in X. Large value.
-                return 10000 if eval['value'] > 0 else -10000
-            
-            return eval['value']
+            key = zobrist_hash(board)
+            with self.lock:
+                entry = self._tt_get(key)
+                if entry is not None and entry[2] is not None and entry[3] >= EVAL_DEPTH:
+                    return entry[2]
+                
+                self.engine.set_fen_position(board.fen(), send_ucinewgame_token=False)
+                # Rough sign is enough for draw decisions, no need for depth 24
+                self.engine.set_depth(EVAL_DEPTH)
+                try:
+                    eval = self.engine.get_evaluation()
+                finally:
+                    self.engine.set_depth(24)
+                # eval is like {'type': 'cp', 'value': 35} or {'type': 'mate', 'value': -2}
+                
+                if eval['type'] == 'mate':
+                    # Mate in X. Large value.
+                    value = 10000 if eval['value'] > 0 else -10000
+                else:
+                    value = eval['value']
+                
+                self._tt_store(key, eval_cp=value, eval_depth=EVAL_DEPTH)
+            return value
         except:
             return 0
 
+# One engine for all games: no respawn per game and the hash table stays warm
+_BRAIN = None
+_BRAIN_LOCK = threading.Lock()
+
+def get_brain():
+    """Returns the shared StockfishBrain, starting the engine on first use."""
+    global _BRAIN
+    with _BRAIN_LOCK:
+        if _BRAIN is None:
+            _BRAIN = StockfishBrain()
+        return _BRAIN
+
 # --- 3. THE AGENT BODY (Lichess Connection) ---
+_WHITE = chess.WHITE # Hoisted for the per-event turn check
+
+def clock_ms(value):
+    """Converts a gameState clock (int ms, or datetime from berserk) to milliseconds. None if missing."""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        epoch = datetime(1970, 1, 1, tzinfo=value.tzinfo)
+        return int((value - epoch).total_seconds() * 1000)
+    if isinstance(value, timedelta):
+        return int(value.total_seconds() * 1000)
+    return int(value)
+
 class GameHandler(threading.Thread):
-    def __init__(self, game_id, **kwargs):
+    def __init__(self, game_id, my_id, challenger=None, **kwargs):
         super().__init__(**kwargs)
         self.game_id = game_id
+        self._my_id = my_id # Our lowercased Lichess id
+        self.my_color = 'white' # Real value arrives with gameFull
+        self._my_is_white = True
+        self.challenger = challenger # Notified when the game ends
         self.board = chess.Board()
+        self._applied_plies = 0
+        self._last_moves_str = None # None forces a parse on the first event
+        self._out_of_book = False # Once a book lookup misses, stop probing
+        self._board_turn_is_mine = False
         self.stream = client.bots.stream_game_state(game_id)
-        self.brain = StockfishBrain() # Connect Stockfish
+        self.brain = get_brain() # Shared Stockfish
+        
+        # Ingest -> worker handoff (see run / ingest)
+        self._state_lock = threading.Lock()
+        self._new_state = threading.Event()
+        self._latest_state = None
+        self._stream_done = False
+        self._thinking_on = None # moves string being searched, None when idle
+        self._superseded = False
 
     def run(self):
-        print(f"🚀 Game Started! ID: {self.game_id}")
+        log.info("🚀 Game Started! ID: %s", self.game_id)
         url = f"https://lichess.org/{self.game_id}"
-        print(f"👀 Watch Live: {url}")
+        log.info("👀 Watch Live: %s", url)
         
         # Notify Telegram
         send_telegram(f"🚀 **Game Started!**\nPlaying vs: Unknown\n[Watch Live]({url})")
 
+        # Network reader runs alongside so a long search never delays incoming states
+        threading.Thread(target=self.ingest, daemon=True).start()
+
+        try:
+            while True:
+                # Only the newest state matters, older ones are superseded
+                self._new_state.wait()
+                with self._state_lock:
+                    state = self._latest_state
+                    self._latest_state = None
+                    self._new_state.clear()
+                    done = self._stream_done
+                
+                if state is not None:
+                    try:
+                        self.handle_state_change(state)
+                    except Exception as inner_e:
+                        log.warning("⚠️ Error processing game event: %s", inner_e)
+                if done:
+                    break
+        finally:
+            # Stream closes when the game ends (also covers resign / flag / abort)
+            if self.challenger:
+                self.challenger.game_finished(self.game_id)
+
+    def ingest(self):
+        """Drains the game stream, keeping only the latest state for the worker in run()."""
+        url = f"https://lichess.org/{self.game_id}"
         try:
             for event in self.stream:
                 try:
                     if event['type'] == 'gameState':
-                        self.handle_state_change(event)
+                        self.post_state(event)
                     elif event['type'] == 'gameFull':
-                        self.my_color = 'white' if event['white'].get('id', '').lower() == 'surendhan' else 'black'
+                        self.my_color = 'white' if event['white'].get('id', '').lower() == self._my_id else 'black'
+                        self._my_is_white = (self.my_color == 'white')
                         
                         # Safe opponent name extraction
-                        if self.my_color == 'white':
+                        if self._my_is_white:
                             opp_info = event.get('black', {})
                         else:
                             opp_info = event.get('white', {})
                         
                         opponent = opp_info.get('username', 'AI/Anonymous')
                         
-                        print(f"♟️ Playing as: {self.my_color} vs {opponent}")
+                        log.info("♟️ Playing as: %s vs %s", self.my_color, opponent)
                         
                         # Save opponent name to instance for later use
                         self.opponent_name = opponent
@@ -171,148 +421,245 @@ class GameHandler(threading.Thread):
                         send_telegram(f"♟️ **Playing as {self.my_color.title()}**\nVs: {opponent}\n[Watch Live]({url})")
 
                         if 'state' in event:
-                            self.handle_state_change(event['state'])
+                            self.post_state(event['state'])
                         else:
-                            self.handle_state_change(event)
+                            self.post_state(event)
                 except Exception as inner_e:
-                    print(f"⚠️ Error processing game event: {inner_e}")
+                    log.warning("⚠️ Error processing game event: %s", inner_e)
                     continue
         except Exception as e:
-            print(f"❌ Game Loop Error (ID: {self.game_id}): {e}")
+            log.error("❌ Game Loop Error (ID: %s): %s", self.game_id, e)
+        finally:
+            with self._state_lock:
+                self._stream_done = True
+                self._new_state.set()
+            self.brain.stop(self.game_id)
 
-    def handle_state_change(self, state):
-        # Update internal board
+    def post_state(self, state):
+        """Hands a state to the worker, interrupting a search on a position that is now stale."""
+        with self._state_lock:
+            self._latest_state = state
+            self._new_state.set()
+        
+        thinking_on = self._thinking_on
+        if thinking_on is None:
+            return
+        if state.get('moves', '') != thinking_on or state.get('status', 'started') != 'started':
+            self._superseded = True
+            self.brain.stop(self.game_id)
+
+    def rebuild_board(self, tokens):
+        """Replays the full move list onto a fresh board."""
         self.board = chess.Board()
+        self._applied_plies = 0
+        for move in tokens:
+            self.board.push_uci(move)
+            self._applied_plies += 1
+
+    def handle_state_change(self, state):
+        # Update internal board (only apply moves we haven't seen yet)
         moves_str = state.get('moves', '')
         
-        if moves_str:
-            try:
-                for move in moves_str.split():
-                    self.board.push_uci(move)
-            except ValueError as ve:
-                print(f"⚠️ Invalid move received: {ve}")
-                return # Can't process state if moves are invalid
+        # Clock ticks / draw offers repeat the same moves, nothing to parse
+        if moves_str != self._last_moves_str:
+            tokens = moves_str.split()
+            last = self._last_moves_str
+            
+            # Only extend when the old history is a whole-move prefix of the new one
+            extends = last is not None and (not last or moves_str.startswith(last + ' '))
+            if extends:
+                try:
+                    for move in tokens[self._applied_plies:]:
+                        self.board.push_uci(move)
+                        self._applied_plies += 1
+                except ValueError:
+                    extends = False
+            if not extends:
+                # Takeback / skipped states / bad push: rebuild from the full list now
+                try:
+                    self.rebuild_board(tokens)
+                except ValueError as ve:
+                    log.warning("⚠️ Invalid move received: %s", ve)
+                    self.board = chess.Board()
+                    self._applied_plies = 0
+                    self._last_moves_str = None
+                    return # Can't process state if moves are invalid
+            self._last_moves_str = moves_str
+        
+        self._board_turn_is_mine = (self.board.turn == _WHITE) == self._my_is_white
         
-        # Check Game Over
-        if self.board.is_game_over():
+        # Check Game Over (once per event, the board doesn't change below)
+        over = self.board.is_game_over()
+        if over:
             result = self.board.result()
-            print(f"🏁 Game Over: {result}")
+            log.info("🏁 Game Over: %s", result)
             send_telegram(f"🏁 **Game Over**\nResult: {result}\nMoves: {self.board.fullmove_number}")
             
             # Update Memory
             if hasattr(self, 'opponent_name'):
-                BOT_MEMORY['last_opponent'] = self.opponent_name
+                BOT_MEMORY['last_opponent'] = self.opponent_name.lower()
                 
                 # Determine if we won/lost
                 # 1-0 means White wins. 0-1 means Black wins.
                 if result == "1-0":
-                    if self.my_color == 'white':
+                    if self._my_is_white:
                         BOT_MEMORY['last_result'] = 'win'
-                        BOT_MEMORY['conquered_bots'].add(self.opponent_name)
+                        BOT_MEMORY['conquered_bots'].add(self.opponent_name.lower())
                     else:
                         BOT_MEMORY['last_result'] = 'loss'
                 elif result == "0-1":
-                    if self.my_color == 'black':
+                    if not self._my_is_white:
                         BOT_MEMORY['last_result'] = 'win'
-                        BOT_MEMORY['conquered_bots'].add(self.opponent_name)
+                        BOT_MEMORY['conquered_bots'].add(self.opponent_name.lower())
                     else:
                         BOT_MEMORY['last_result'] = 'loss'
                 else:
                     BOT_MEMORY['last_result'] = 'draw'
                 
-                print(f"🧠 Memory Updated: Played {self.opponent_name}, Result: {BOT_MEMORY['last_result']}")
-                print(f"🏆 Conquered Bots: {list(BOT_MEMORY['conquered_bots'])}")
+                log.info("🧠 Memory Updated: Played %s, Result: %s", self.opponent_name, BOT_MEMORY['last_result'])
+                log.info("🏆 Conquered Bots: %s", list(BOT_MEMORY['conquered_bots']))
             
+            if self.challenger:
+                self.challenger.game_finished(self.game_id)
             return
         
         # --- DRAW OFFER LOGIC ---
         # Check if opponent offered a draw
         # 'wDraw' means white is offering. 'bDraw' means black is offering.
-        opponent_offering_draw = False
-        if self.my_color == 'black' and state.get('wDraw'):
-            opponent_offering_draw = True
-        elif self.my_color == 'white' and state.get('bDraw'):
-            opponent_offering_draw = True
+        opponent_offering_draw = bool(state.get('bDraw' if self._my_is_white else 'wDraw'))
 
         if opponent_offering_draw:
-            print(f"🤝 Opponent offered draw!")
+            log.info("🤝 Opponent offered draw!")
             # Evaluate position
             eval_cp = self.brain.get_evaluation(self.board)
-            print(f"📊 Evaluation: {eval_cp} cp")
+            log.info("📊 Evaluation: %s cp", eval_cp)
             
             # Accept if we are losing or drawn (eval < 100 cp)
             # Since eval is from side to move (us), if it's low, we are not winning much.
             if eval_cp < 100:
-                print("✅ Accepting draw offer (Eval < 100cp)")
+                log.info("✅ Accepting draw offer (Eval < 100cp)")
                 try:
                     client.board.accept_draw(self.game_id)
                     return # Accepted, no need to move (game will end)
                 except Exception as e:
-                    print(f"⚠️ Failed to accept draw: {e}")
+                    log.warning("⚠️ Failed to accept draw: %s", e)
             else:
-                print("❌ Declining/Ignoring draw (We are winning!)")
+                log.info("❌ Declining/Ignoring draw (We are winning!)")
 
         # Proper turn check based on color
-        is_white_turn = self.board.turn == chess.WHITE
-        my_color = getattr(self, 'my_color', 'white')
-        
-        is_my_turn = (my_color == 'white' and is_white_turn) or (my_color == 'black' and not is_white_turn)
-        
-        if not is_my_turn:
+        if not self._board_turn_is_mine:
             return  # Not our turn, wait
-        
-        if self.board.is_game_over():
-            print("🏁 Game Over!")
-            return
 
         try:
-            # 1. Ask Stockfish for the move
-            best_move = self.brain.decide_move(self.board)
+            # 1. Opening book first, until we leave it for this game
+            best_move = None
+            if not self._out_of_book:
+                best_move = self.brain.book_move(self.board)
+                if best_move is None:
+                    self._out_of_book = True
+            
+            if best_move is None:
+                # Ask Stockfish for the move (spend ~1/30 of our remaining clock)
+                my_time_ms = clock_ms(state.get('wtime' if self._my_is_white else 'btime'))
+                if my_time_ms is None:
+                    budget_ms = MAX_MOVE_TIME_MS
+                else:
+                    budget_ms = max(MIN_MOVE_TIME_MS, min(MAX_MOVE_TIME_MS, my_time_ms // 30))
+                self._superseded = False
+                self._thinking_on = state.get('moves', '')
+                try:
+                    best_move = self.brain.decide_move(self.board, budget_ms, owner=self.game_id,
+                                                       should_abort=lambda: self._superseded)
+                finally:
+                    self._thinking_on = None
+                
+                if self._superseded:
+                    log.info("⏭️ Position changed while thinking, skipping stale move.")
+                    return
             
             # 2. Send to Lichess
             client.bots.make_move(self.game_id, best_move.uci())
-            print(f"✅ Move sent: {best_move.uci()}")
+            log.info("✅ Move sent: %s", best_move.uci())
             
         except berserk.exceptions.ResponseError as e:
             # This error occurs if we try to move when it's not our turn
-            print(f"⚠️ Move error: {e}")
+            log.warning("⚠️ Move error: %s", e)
             pass
         except Exception as e:
-            print(f"❌ Unexpected Game Error: {e}")
+            log.error("❌ Unexpected Game Error: %s", e)
 
-# --- 4. MAIN LOOP ---
 # --- 4. AUTO-CHALLENGER ---
+IDLE_RETRY = 120 # Seconds before re-challenging if nobody accepted
+BOTS_CACHE_TTL = 120 # Seconds to reuse the online bots list
+
 class ChallengeManager(threading.Thread):
     def __init__(self, my_username):
         super().__init__()
         self.my_username = my_username
         self.daemon = True # Kill when main thread ends
+        self.idle = threading.Event() # Set when no game is running
+        self.idle.set()
+        self._active_games = set()
+        self._games_lock = threading.Lock()
+        self._bots_cache = (0, [], {}) # (fetched_at, targets, {username.lower(): bot})
+
+    def get_targets(self):
+        """Returns online bots (minus ourselves) and a lowercase-name index, cached for BOTS_CACHE_TTL."""
+        fetched_at, targets, by_lower = self._bots_cache
+        if time.time() - fetched_at < BOTS_CACHE_TTL:
+            return targets, by_lower
+        
+        online_bots = list(client.bots.get_online_bots(limit=50))
+        
+        # Filter out ourselves
+        my_name = self.my_username.lower()
+        targets = [bot for bot in online_bots if bot['username'].lower() != my_name]
+        by_lower = {bot['username'].lower(): bot for bot in targets}
+        if targets: # Don't cache an empty list, refetch on the next try
+            self._bots_cache = (time.time(), targets, by_lower)
+        return targets, by_lower
+
+    def invalidate_targets(self):
+        """Forces the next get_targets() to refetch online bots."""
+        self._bots_cache = (0, [], {})
+
+    def game_started(self, game_id):
+        with self._games_lock:
+            self._active_games.add(game_id)
+            self.idle.clear()
+
+    def game_finished(self, game_id):
+        with self._games_lock:
+            self._active_games.discard(game_id)
+            if not self._active_games:
+                self.idle.set()
+
+    def retry_later(self, delay=60):
+        """Sleeps, then re-arms matchmaking unless a game started meanwhile."""
+        time.sleep(delay)
+        with self._games_lock:
+            if not self._active_games:
+                self.idle.set()
 
     def run(self):
-        print(f"🔎 Auto-Challenger: STARTED. Hunting for opponents...")
+        log.info("🔎 Auto-Challenger: STARTED. Hunting for opponents...")
         while True:
             try:
-                # 1. Check if we are busy
-                ongoing_games = list(client.games.get_ongoing())
-                if ongoing_games:
-                    print(f"🔎 Auto-Challenger: Currently playing {len(ongoing_games)} game(s). Sleeping...")
-                    time.sleep(60)
-                    continue
+                # 1. Wait until we are free (timeout retries challenges nobody answered)
+                self.idle.wait(timeout=IDLE_RETRY)
+                with self._games_lock:
+                    self.idle.clear()
+                    if self._active_games:
+                        continue
 
                 # 2. MATCHMAKING LOGIC
                 # Default: random bot from list
-                print("🔎 Auto-Challenger: Seeking opponents...")
-                online_bots = list(client.bots.get_online_bots(limit=50))
-                
-                # Filter out ourselves
-                valid_targets = [
-                    bot for bot in online_bots 
-                    if bot['username'].lower() != self.my_username.lower()
-                ]
+                log.info("🔎 Auto-Challenger: Seeking opponents...")
+                valid_targets, bots_by_lower = self.get_targets()
                 
                 if not valid_targets:
-                    print("🔎 Auto-Challenger: No bots found. Sleeping...")
-                    time.sleep(60)
+                    log.info("🔎 Auto-Challenger: No bots found. Sleeping...")
+                    self.retry_later()
                     continue
 
                 target_name = None
@@ -320,81 +667,85 @@ class ChallengeManager(threading.Thread):
                 # REVENGE MODE: If we lost last game, try to find that bot
                 if BOT_MEMORY['last_result'] == 'loss' and BOT_MEMORY['last_opponent']:
                     revenge_target = BOT_MEMORY['last_opponent']
-                    print(f"🔥 REVENGE MODE: Hunting for {revenge_target}...")
+                    log.info("🔥 REVENGE MODE: Hunting for %s...", revenge_target)
                     
                     # Check if they are online
-                    for bot in valid_targets:
-                        if bot['username'].lower() == revenge_target.lower():
-                            target_name = bot['username']
-                            print(f"⚔️ Found nemesis {target_name}! Challenging for revenge!")
-                            break
+                    revenge_bot = bots_by_lower.get(revenge_target)
+                    if revenge_bot:
+                        target_name = revenge_bot['username']
+                        log.info("⚔️ Found nemesis %s! Challenging for revenge!", target_name)
                 
                 if not target_name:
                     # CONQUEROR MODE: Avoid bots we have beaten
                     # Filter out conquered bots from potential targets
                     fresh_targets = [
                         b for b in valid_targets 
-                        if b['username'] not in BOT_MEMORY['conquered_bots']
+                        if b['username'].lower() not in BOT_MEMORY['conquered_bots']
                     ]
                     
                     if fresh_targets:
                         # VARIETY: Avoid last played opponent if possible
                         if BOT_MEMORY['last_opponent']:
                             ignored = BOT_MEMORY['last_opponent']
-                            very_fresh = [b for b in fresh_targets if b['username'].lower() != ignored.lower()]
+                            very_fresh = [b for b in fresh_targets if b['username'].lower() != ignored]
                             if very_fresh:
                                 target = random.choice(very_fresh)
                                 target_name = target['username']
-                                print(f"✨ Fresh Meat: Challenging {target_name} (New Opponent)")
+                                log.info("✨ Fresh Meat: Challenging %s (New Opponent)", target_name)
                             else:
                                 target = random.choice(fresh_targets)
                                 target_name = target['username']
-                                print(f"⚔️ Challenging {target_name} (Unbeaten)")
+                                log.info("⚔️ Challenging %s (Unbeaten)", target_name)
                         else:
                             target = random.choice(fresh_targets)
                             target_name = target['username']
-                            print(f"⚔️ Challenging {target_name} (Unbeaten)")
+                            log.info("⚔️ Challenging %s (Unbeaten)", target_name)
                     else:
                         # FALLBACK: No new bots found. Play with tough old bots.
-                        print("⚠️ No fresh opponents found.")
+                        log.warning("⚠️ No fresh opponents found.")
                         if valid_targets:
                             # Just pick anyone (including conquered ones)
                             target = random.choice(valid_targets)
                             target_name = target['username']
-                            print(f"🔄 Fallback: Challenging {target_name} again (Old Rival)")
+                            log.info("🔄 Fallback: Challenging %s again (Old Rival)", target_name)
                 
                 # FINAL FALLBACK check
                 if not target_name and valid_targets:
                      target = random.choice(valid_targets)
                      target_name = target['username']
-                     print(f"🎲 Random Challenge: {target_name}")
+                     log.info("🎲 Random Challenge: %s", target_name)
 
                 if target_name:
                     try:
                         # 3+0 Blitz game
                         client.challenges.create(target_name, rated=True, clock_limit=180, clock_increment=0, color='random')
                     except Exception as e:
-                        print(f"⚠️ Challenge failed: {e}")
-                
-                # Wait before trying again
-                time.sleep(45)
+                        log.warning("⚠️ Challenge failed: %s", e)
+                        # Target may have gone offline, don't pick it from a stale list
+                        self.invalidate_targets()
+                        # Back off before retrying (avoid hammering Lichess on 429s)
+                        self.retry_later()
 
             except Exception as e:
-                print(f"❌ Auto-Challenger Error: {e}")
-                time.sleep(60)
+                log.error("❌ Auto-Challenger Error: %s", e)
+                self.retry_later()
 
 # --- 5. MAIN LOOP ---
 if __name__ == "__main__":
-    print("🤖 Gemini Chess Agent is ONLINE...")
+    logging.basicConfig(stream=sys.stdout, format="%(message)s")
+    log.info("🤖 Gemini Chess Agent is ONLINE...")
     
     # correct way to fetch profile
     try:
         me = client.account.get()
-        print(f"Logged in as: {me['username']}")
+        log.info("Logged in as: %s", me['username'])
     except Exception as e:
-        print(f"⚠️ Login Warning: {e}")
+        log.warning("⚠️ Login Warning: %s", e)
+
+    my_id = me['username'].lower() if 'me' in locals() else ''
 
     # Start Auto Challenger
+    challenger = None
     if 'me' in locals():
         challenger = ChallengeManager(me['username'])
         challenger.start()
@@ -409,36 +760,28 @@ if __name__ == "__main__":
                     
                     # Don't try to accept our own challenges (if that ever happens)
                     if challenger_name.lower() == me['username'].lower():
-                        print(f"Skipping self-challenge event.")
+                        log.info("Skipping self-challenge event.")
                         continue
 
-                    print(f"🛡️ Challenge from {challenger_name}! Accepting...")
+                    log.info("🛡️ Challenge from %s! Accepting...", challenger_name)
                     try:
                         client.bots.accept_challenge(event['challenge']['id'])
                     except Exception as e:
-                        print(f"Could not accept challenge: {e}")
+                        log.warning("Could not accept challenge: %s", e)
+
+                elif event['type'] == 'challengeDeclined':
+                    # Our challenge was refused, look for someone else
+                    if challenger:
+                        challenger.game_finished(None)
 
                 elif event['type'] == 'gameStart':
                     game_id = event['game']['id']
-                    # Pass the client explicitly if needed, but GameHandler uses global client currently?
-                    # Wait, checking GameHandler init in file...
-                    # Line 133: class GameHandler(threading.Thread):
-                    # Line 134: def __init__(self, game_id, **kwargs):
-                    # It relies on global 'client'.
-                    # But in my previous edit (Step 600), I changed it to: handler = GameHandler(client, game_id)
-                    # Let me check the file content again carefully.
-                    # Line 417 in previous ViewFile: handler = GameHandler(client, game_id)
-                    # BUT Line 134 definition: def __init__(self, game_id, **kwargs):
-                    # This is a MISMATCH introduced by me.
-                    
-                    # I SHOULD FIX THIS MISMATCH too.
-                    # I will revert the call to: handler = GameHandler(game_id)
-                    # OR update the class definition.
-                    # Since I am editing the main block, I will fix the call site here.
-                    handler = GameHandler(game_id)
+                    if challenger:
+                        challenger.game_started(game_id)
+                    handler = GameHandler(game_id, my_id, challenger=challenger)
                     handler.start()
         
         except Exception as e:
-            print(f"⚠️ Connection lost: {e}")
-            print("🔄 Reconnecting in 5 seconds...")
+            log.warning("⚠️ Connection lost: %s", e)
+            log.info("🔄 Reconnecting in 5 seconds...")
             time.sleep(5)
\ No newline at end of file